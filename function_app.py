@@ -1,58 +1,491 @@
 import azure.functions as func
 import logging
 import json
-import yaml
 import os
-import requests
-from datetime import datetime, timezone
-from azure.cosmos import CosmosClient
-from typing import Optional, Dict, Any, List
+import re
+import hashlib
+import stat
+import threading
+import tempfile
+import asyncio
+import functools
+import importlib
+import string
+import time
+from typing import TYPE_CHECKING, Optional, Dict, Any, Callable, List, Set, Tuple
+
+# 重いモジュールはコールドスタートを短くするため、実際に必要になった時点で読み込む
+if TYPE_CHECKING:
+    import diskcache
+    import httpx
+    from azure.cosmos.aio import ContainerProxy
+
+logger = logging.getLogger(__name__)
+
+# orjsonがあれば高速なJSONエンコード/デコードを使用する
+try:
+    import orjson
+
+    def json_dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+        """オブジェクトをJSON文字列に変換（非ASCII文字はエスケープしない）"""
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option).decode('utf-8')
+
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+        """オブジェクトをJSON文字列に変換（非ASCII文字はエスケープしない）"""
+        return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None, sort_keys=sort_keys)
+
+    json_loads = json.loads
+    orjson = None
 
 # 設定ファイルの読み込み
+CONFIG_PATH = 'config.yaml'
+
+# 設定値中の環境変数参照（${VAR_NAME}）
+ENV_PLACEHOLDER = re.compile(r'\$\{([^}]+)\}')
+
+
+def _is_private(st: os.stat_result, mode_mask: int) -> bool:
+    """実行ユーザーの所有で、mode_maskの権限が他ユーザーに与えられていないことを確認"""
+    # Windowsには所有者IDがなく、一時ディレクトリもユーザーごとに分かれている
+    if not hasattr(os, 'getuid'):
+        return True
+    return st.st_uid == os.getuid() and not st.st_mode & mode_mask
+
+
+def _user_temp_dir(name: str) -> str:
+    """一時ディレクトリ内の実行ユーザーごとのディレクトリパスを返す"""
+    user = os.getuid() if hasattr(os, 'getuid') else 'user'
+    return os.path.join(tempfile.gettempdir(), f'{name}_{user}')
+
+
+def _private_dir(path: str) -> str:
+    """実行ユーザー専用（0700）のディレクトリを用意し、安全であることを確認して返す"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    
+    # 他ユーザーが先に作成したディレクトリやシンボリックリンクは使わない
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or not _is_private(st, 0o077):
+        raise PermissionError(f"キャッシュディレクトリが安全ではありません: {path}")
+    return path
+
+
+def _config_cache_path(raw: bytes) -> str:
+    """設定ファイルの内容ハッシュから、実行ユーザー専用ディレクトリ内のキャッシュファイルパスを生成"""
+    cache_dir = _private_dir(_user_temp_dir('daily_report_config'))
+    digest = hashlib.md5(raw).hexdigest()
+    return os.path.join(cache_dir, f'config.{digest}.json')
+
+
+def _load_yaml(raw: bytes) -> Any:
+    """YAMLをパース（libyamlのCバインディングがあれば優先して使用する）"""
+    import yaml
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader
+    return yaml.load(raw, Loader=SafeLoader)
+
+
+def _write_config_cache(cache_path: str, config: Dict[str, Any]) -> None:
+    """パース結果をJSONとしてキャッシュに書き出す"""
+    # JSONで表現できない値（日付や文字列以外のキーなど）を含む場合はキャッシュしない
+    try:
+        content = json_dumps(config)
+        if json_loads(content) != config:
+            return
+    except (TypeError, ValueError):
+        return
+    
+    # 一時ファイルに書き出してからリネームし、途中状態のキャッシュを読ませない
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(content)
+        os.replace(tmp_path, cache_path)
+        tmp_path = None
+    except Exception as e:
+        logger.warning("設定キャッシュ書き込みエラー (無視して続行): %s", e)
+    finally:
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def _parse_config(raw: bytes) -> Dict[str, Any]:
+    """キャッシュがあれば読み込み、なければYAMLをパースしてキャッシュを書き出す"""
+    cache_path = None
+    try:
+        cache_path = _config_cache_path(raw)
+        with open(cache_path, 'rb') as file:
+            if _is_private(os.fstat(file.fileno()), 0o022):
+                return json_loads(file.read())
+            logger.warning("設定キャッシュの所有者または権限が不正なため使用しません: %s", cache_path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("設定キャッシュ読み込みエラー (YAMLを再パースします): %s", e)
+
+    config = _load_yaml(raw)
+    if cache_path is not None:
+        _write_config_cache(cache_path, config)
+
+    return config
+
+
+def _resolve_env_placeholders(node: Any) -> None:
+    """${...}を含む値のみ環境変数で置換する（未設定の場合はそのまま残す）"""
+    items = node.items() if isinstance(node, dict) else enumerate(node)
+    for key, value in items:
+        if isinstance(value, str):
+            if '${' in value:
+                node[key] = ENV_PLACEHOLDER.sub(
+                    lambda m: os.environ.get(m.group(1), m.group(0)), value
+                )
+        elif isinstance(value, (dict, list)):
+            _resolve_env_placeholders(value)
+
+
 def load_config() -> Dict[str, Any]:
     """config.yamlから設定を読み込む"""
     try:
-        with open('config.yaml', 'r', encoding='utf-8') as file:
-            config = yaml.safe_load(file)
+        with open(CONFIG_PATH, 'rb') as file:
+            raw = file.read()
         
-        # 環境変数の置換
-        config['cosmosdb']['endpoint'] = os.getenv('COSMOSDB_ENDPOINT', config['cosmosdb']['endpoint'])
-        config['cosmosdb']['key'] = os.getenv('COSMOSDB_KEY', config['cosmosdb']['key'])
+        config = _parse_config(raw)
+        
+        # 環境変数の置換（キャッシュは置換前の値を保持する）
+        if b'${' in raw:
+            _resolve_env_placeholders(config)
         
         return config
     except Exception as e:
-        logging.error(f"設定ファイル読み込みエラー: {e}")
+        logger.error("設定ファイル読み込みエラー: %s", e)
         raise
 
-# CosmosDBクライアントの初期化
+class _CosmosJsonShim:
+    """Cosmos SDK内部のjsonモジュール参照を差し替えるためのorjsonラッパー"""
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(json, name)
+    
+    @staticmethod
+    def dumps(obj: Any, **kwargs: Any) -> str:
+        # SDKが指定するseparators以外のオプションが渡された場合は標準ライブラリに任せる
+        if set(kwargs) <= {'separators'}:
+            try:
+                return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+            except TypeError:
+                pass
+        return json.dumps(obj, **kwargs)
+    
+    @staticmethod
+    def loads(s: Any, **kwargs: Any) -> Any:
+        return json.loads(s, **kwargs) if kwargs else orjson.loads(s)
+
+
+# リクエスト本文のエンコードとレスポンスのデコードを行うCosmos SDK内部モジュール
+COSMOS_JSON_MODULES = (
+    'azure.cosmos._synchronized_request',
+    'azure.cosmos.aio._asynchronous_request',
+)
+
+
+def use_orjson_for_cosmos() -> None:
+    """Cosmos SDKのJSONエンコード/デコードをorjsonに置き換える"""
+    if orjson is None:
+        return
+    shim = _CosmosJsonShim()
+    for module_name in COSMOS_JSON_MODULES:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            logger.warning("Cosmos SDKのJSON差し替えをスキップ: %s", e)
+            continue
+        # SDKの構成が想定と異なる場合は差し替えない
+        if getattr(module, 'json', None) is json:
+            module.json = shim
+
 config = load_config()
 
-# 環境変数から実際の値を取得、なければconfig.yamlのダミー値を使用
-cosmos_endpoint = os.environ.get('COSMOSDB_ENDPOINT', config['cosmosdb']['endpoint'])
-cosmos_key = os.environ.get('COSMOSDB_KEY', config['cosmosdb']['key'])
+# CosmosDBコンテナー（初回アクセス時に初期化）
+_container: Optional['ContainerProxy'] = None
+_cosmos_initialized = False
 
-# 開発環境での起動を可能にするため、実際の接続情報がある場合のみ初期化
-cosmos_client = None
-if (cosmos_endpoint and cosmos_key and 
-    not cosmos_endpoint.startswith('${') and 
-    not cosmos_key.startswith('${') and
-    not cosmos_key == 'dummy_key_for_development'):
+
+def get_container() -> Optional['ContainerProxy']:
+    """CosmosDBコンテナーを取得（初回のみSDKを読み込んで接続を初期化）"""
+    global _container, _cosmos_initialized
+    if _cosmos_initialized:
+        return _container
+    _cosmos_initialized = True
+    
+    # 環境変数はload_config()で置換済み（未設定の場合は${...}のまま残る）
+    cosmos_endpoint = config['cosmosdb']['endpoint']
+    cosmos_key = config['cosmosdb']['key']
+    
+    # 開発環境での起動を可能にするため、実際の接続情報がある場合のみ初期化
+    if not (cosmos_endpoint and cosmos_key and
+            '${' not in cosmos_endpoint + cosmos_key and
+            cosmos_key != 'dummy_key_for_development'):
+        print("開発モード: CosmosDB接続をスキップ")
+        return None
+    
     try:
+        from azure.cosmos.aio import CosmosClient
+        use_orjson_for_cosmos()
         cosmos_client = CosmosClient(cosmos_endpoint, cosmos_key)
         database = cosmos_client.get_database_client(config['cosmosdb']['database_name'])
-        container = database.get_container_client(config['cosmosdb']['container_name'])
+        _container = database.get_container_client(config['cosmosdb']['container_name'])
     except Exception as e:
         print(f"CosmosDB接続エラー (開発時は無視可能): {e}")
-        cosmos_client = None
-        database = None
-        container = None
-else:
-    print("開発モード: CosmosDB接続をスキップ")
-    database = None
-    container = None
+        _container = None
+    
+    return _container
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
+# 一時的なエラーに対する再試行設定（再試行・ヘッジを含めた全体の待ち時間はCOPILOT_TOTAL_TIMEOUTで打ち切る）
+COPILOT_TOTAL_TIMEOUT = 30.0
+COPILOT_MAX_RETRIES = 3
+COPILOT_BACKOFF_FACTOR = 0.25
+COPILOT_RETRY_STATUSES = frozenset({429, 502, 503, 504})
+COPILOT_MAX_RETRY_AFTER = 10.0
+COPILOT_CONNECT_TIMEOUT = 3.0
+COPILOT_READ_TIMEOUT = 25.0   # max_tokens: 1000 の生成が収まる長さ
+COPILOT_MIN_ATTEMPT_TIME = 5.0  # 残り時間がこれを下回る場合は次の試行を行わない
+
+
+class CopilotUnavailableError(Exception):
+    """再試行を使い切ってもGitHub Copilot APIから応答が得られなかった"""
+
+
+# GitHub Copilot API呼び出し用のHTTP/2クライアント（1本の接続上で並行リクエストを多重化し、ワーカー内で使い回す）
+_http_client: Optional['httpx.AsyncClient'] = None
+
+# ヘッジリクエスト専用のHTTP/1.1クライアント（通常のリクエストと接続を共有しない）
+_hedge_http_client: Optional['httpx.AsyncClient'] = None
+
+# ワーカー内で実行中のヘッジリクエスト数
+_active_hedges = 0
+
+# 同一プロンプトに対するフィードバックのキャッシュ
+_response_cache: Optional['diskcache.Cache'] = None
+_response_cache_lock = threading.Lock()
+
+# temperatureがこの値以下なら応答が決定的とみなしてキャッシュする
+DETERMINISTIC_TEMPERATURE = 0.1
+
+# プロンプトテンプレートに個別に埋め込むため追加情報から除外する日報の項目
+PROMPT_EXTRACTED_FIELDS = frozenset({'submissionDate', 'name', 'goodThings', 'reflections'})
+
+# 時刻文字列のキャッシュ（秒が変わったときだけ書式化し直す）
+_last_second = -1
+_last_iso_time = ''
+
+# 実行中のCosmosDB書き込みタスク（完了前にガベージコレクトされないよう参照を保持）
+_pending_writes: Set[asyncio.Task] = set()
+
+
+def get_http_client() -> 'httpx.AsyncClient':
+    """HTTP/2クライアントを取得（初回のみhttpxを読み込んで生成）"""
+    global _http_client
+    if _http_client is None:
+        import httpx
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(COPILOT_READ_TIMEOUT, connect=COPILOT_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+        )
+    return _http_client
+
+
+def get_hedge_http_client() -> 'httpx.AsyncClient':
+    """ヘッジ用クライアントを取得（接続単位の遅延の影響を受けないよう別の接続を使う）"""
+    global _hedge_http_client
+    if _hedge_http_client is None:
+        import httpx
+        _hedge_http_client = httpx.AsyncClient(
+            http2=False,
+            timeout=httpx.Timeout(COPILOT_READ_TIMEOUT, connect=COPILOT_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+    return _hedge_http_client
+
+
+def _retry_delay(attempt: int, response: Optional['httpx.Response'] = None) -> float:
+    """再試行までの待ち時間を返す（Retry-Afterヘッダーがあれば上限付きで従う）"""
+    if response is not None:
+        try:
+            return min(float(response.headers['Retry-After']), COPILOT_MAX_RETRY_AFTER)
+        except (KeyError, ValueError):
+            pass
+    return COPILOT_BACKOFF_FACTOR * (2 ** attempt)
+
+
+async def post_with_retry(url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                          deadline: float, client: Optional['httpx.AsyncClient'] = None,
+                          max_retries: int = COPILOT_MAX_RETRIES,
+                          backing_off: Optional[asyncio.Event] = None) -> Tuple[int, str]:
+    """期限（イベントループの時刻）までの範囲で再試行付きでPOSTし、ステータスコードとレスポンス本文を返す"""
+    import httpx
+    client = client or get_http_client()
+    loop = asyncio.get_running_loop()
+    content = json_dumps(payload).encode('utf-8')
+    for attempt in range(max_retries + 1):
+        remaining = deadline - loop.time()
+        timeout = httpx.Timeout(
+            min(COPILOT_READ_TIMEOUT, remaining),
+            connect=min(COPILOT_CONNECT_TIMEOUT, remaining)
+        )
+        try:
+            response = await client.post(url, headers=headers, content=content, timeout=timeout)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            # リクエスト送信前のエラーのみ再試行する
+            error = CopilotUnavailableError(f"接続エラー: {e!r}")
+            delay = _retry_delay(attempt)
+        except httpx.TransportError as e:
+            # 送信後のエラー（応答タイムアウト・読み書きエラーなど）はサーバー側で生成が続いている可能性があり、
+            # 再送すると二重に課金されるため再試行しない
+            raise CopilotUnavailableError(f"通信エラー: {e!r}") from e
+        else:
+            if response.status_code not in COPILOT_RETRY_STATUSES:
+                return response.status_code, response.text
+            error = CopilotUnavailableError(f"{response.status_code} - {response.text}")
+            delay = _retry_delay(attempt, response)
+        
+        # 再試行回数を使い切ったか、待機後の残り時間で次の試行が収まらない場合は打ち切る
+        if attempt == max_retries or deadline - loop.time() - delay < COPILOT_MIN_ATTEMPT_TIME:
+            raise error
+        # 呼び出し元（ヘッジ処理）に再試行待ちに入ったことを知らせる
+        if backing_off is not None:
+            backing_off.set()
+        await asyncio.sleep(delay)
+
+
+def current_timestamp() -> str:
+    """ISO 8601形式のUTCタイムスタンプを返す"""
+    global _last_second, _last_iso_time
+    second, nanos = divmod(time.time_ns(), 1_000_000_000)
+    if second != _last_second:
+        _last_iso_time = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+        _last_second = second
+    return f"{_last_iso_time}.{nanos // 1000:06d}+00:00"
+
+
+def make_report_id(submitter_email: str, submission_date: str) -> str:
+    """送信者と日付から決定的なドキュメントIDを生成（再送信・再試行で同じIDになる）"""
+    digest = hashlib.sha256(f'{submitter_email}|{submission_date}'.encode('utf-8')).hexdigest()
+    return f'rpt_{digest[:24]}'
+
+
+def compile_template(template: str) -> Callable[..., str]:
+    """str.format形式のテンプレートを事前に分解し、文字列の連結だけで描画する関数を返す"""
+    parts: List[Tuple[str, Optional[str]]] = []
+    for literal, field_name, format_spec, conversion in string.Formatter().parse(template):
+        # 書式指定や位置引数などを含む場合は通常のformatで描画する
+        if format_spec or conversion or (field_name is not None and not field_name.isidentifier()):
+            return lambda **fields: template.format(**fields)
+        parts.append((literal, field_name))
+    
+    def render(**fields: Any) -> str:
+        chunks = []
+        for literal, field_name in parts:
+            chunks.append(literal)
+            if field_name is not None:
+                chunks.append(str(fields[field_name]))
+        return ''.join(chunks)
+    
+    return render
+
+
+async def _write_report(container: 'ContainerProxy', document: Dict[str, Any], overwrite: bool) -> None:
+    """日報ドキュメントを書き込む（overwriteでない場合は既存のドキュメントを残す）"""
+    if overwrite:
+        await container.upsert_item(body=document)
+        return
+    
+    from azure.cosmos.exceptions import CosmosResourceExistsError
+    try:
+        await container.create_item(body=document)
+    except CosmosResourceExistsError:
+        logger.info("既存の日報を保持（フィードバック取得失敗のため上書きしない）: %s", document['id'])
+
+
+def _log_write_result(report_id: str, task: asyncio.Task) -> None:
+    """バックグラウンドで行ったCosmosDB書き込みの結果をログに出力"""
+    _pending_writes.discard(task)
+    if task.cancelled():
+        logger.error("CosmosDB保存が中断されました: %s", report_id)
+    elif task.exception() is not None:
+        logger.error("CosmosDB保存エラー: %s - %s", report_id, task.exception())
+    else:
+        logger.info("データ保存成功: %s", report_id)
+
+
+def get_response_cache(directory: Optional[str]) -> 'diskcache.Cache':
+    """フィードバックキャッシュを取得（初回のみdiskcacheを読み込み、実行ユーザー専用ディレクトリに生成）"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            import diskcache
+            _response_cache = diskcache.Cache(_private_dir(directory or _user_temp_dir('daily_report_copilot_cache')))
+    return _response_cache
+
+
+def read_cached_feedback(directory: Optional[str], key: str) -> Optional[Dict[str, Any]]:
+    """キャッシュからフィードバックを読み込む（SQLiteへの同期I/Oのため別スレッドで呼び出す）"""
+    cached = get_response_cache(directory).get(key)
+    return json_loads(cached) if isinstance(cached, str) else None
+
+
+def write_cached_feedback(directory: Optional[str], key: str, feedback: Dict[str, Any], ttl: int) -> None:
+    """フィードバックをJSON文字列としてキャッシュに書き込む（別スレッドで呼び出す）"""
+    get_response_cache(directory).set(key, json_dumps(feedback), expire=ttl)
+
+
+async def post_with_hedging(url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                            hedge_delay: float, max_hedges: int, deadline: float) -> Tuple[int, str]:
+    """一定時間内に応答がなければ同じリクエストを追加送信し、先に成功した方を採用する"""
+    global _active_hedges
+    backing_off = asyncio.Event()
+    tasks = [asyncio.create_task(post_with_retry(url, headers, payload, deadline, backing_off=backing_off))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+        # レート制限などで再試行待ちに入っている場合は負荷を増やさないよう追加送信しない
+        if done or backing_off.is_set() or _active_hedges >= max_hedges:
+            return await tasks[0]
+        
+        _active_hedges += 1
+        try:
+            # 追加送信は再試行なしの1回だけとする
+            tasks.append(asyncio.create_task(
+                post_with_retry(url, headers, payload, deadline,
+                                client=get_hedge_http_client(), max_retries=0)
+            ))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            # 両方失敗した場合は最初のリクエストの例外を送出
+            return await tasks[0]
+        finally:
+            _active_hedges -= 1
+    finally:
+        for task in tasks:
+            task.cancel()
+
 class DailyReportProcessor:
     """日報処理クラス"""
     
@@ -61,14 +494,47 @@ class DailyReportProcessor:
         self.github_token = os.getenv('GITHUB_TOKEN')
         if not self.github_token:
             raise ValueError("GITHUB_TOKEN環境変数が設定されていません")
+        
+        # リクエストごとに変わらないテンプレート・ヘッダー・ペイロードを事前に組み立てておく
+        self._render_prompt = compile_template(config['prompts']['user_template'])
+        copilot_config = config['github_copilot']
+        self._headers = {
+            'Authorization': f'Bearer {self.github_token}',
+            'Content-Type': 'application/json'
+        }
+        self._system_message = {
+            'role': 'system',
+            'content': config['prompts']['feedback_system']
+        }
+        self._payload_base = {
+            'model': copilot_config['model'],
+            'max_tokens': copilot_config['max_tokens'],
+            'temperature': copilot_config['temperature']
+        }
     
-    def get_previous_report(self, user_email: str, current_date: str) -> Optional[Dict[str, Any]]:
+    def _response_cache_for(self, payload: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], str]:
+        """キャッシュが使える場合はキャッシュ設定とペイロードのハッシュキーを返す"""
+        cache_config = self.config['github_copilot'].get('response_cache', {})
+        if not cache_config.get('enabled', False):
+            return None, ''
+        
+        # temperatureが高い場合は応答が毎回変わるため、明示的に許可されない限りキャッシュしない
+        if (payload['temperature'] > DETERMINISTIC_TEMPERATURE and
+                not cache_config.get('cache_nondeterministic', False)):
+            return None, ''
+        
+        key = hashlib.sha256(
+            json_dumps(payload, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        return cache_config, key
+    
+    async def get_previous_report(self, user_email: str, current_date: str) -> Optional[Dict[str, Any]]:
         """前回の日報を取得"""
         try:
             query = """
                 SELECT TOP 1 * FROM c 
                 WHERE c.metadata.submitterEmail = @email 
-                AND c.type = 'daily_report'
+                AND c.type = 'daily_report_with_feedback'
                 AND c.data.submissionDate < @current_date
                 ORDER BY c.data.submissionDate DESC
             """
@@ -78,22 +544,38 @@ class DailyReportProcessor:
                 {"name": "@current_date", "value": current_date}
             ]
             
-            items = list(container.query_items(
+            # パーティションキー（送信者メールアドレス）を指定して単一パーティション内で検索
+            # 先頭の1件だけを取り出し、結果全体をメモリに展開しない
+            items = get_container().query_items(
                 query=query,
                 parameters=parameters,
-                enable_cross_partition_query=True
-            ))
+                partition_key=user_email,
+                max_item_count=1
+            )
+            async for item in items:
+                return item
             
-            return items[0] if items else None
+            return None
             
         except Exception as e:
-            logging.error(f"前回日報取得エラー: {e}")
+            logger.error("前回日報取得エラー: %s", e)
             return None
     
-    def create_ai_prompt(self, current_report: Dict[str, Any], previous_report: Optional[Dict[str, Any]]) -> str:
+    def prepare_prompt_fields(self, current_report: Dict[str, Any]) -> Dict[str, str]:
+        """今回の日報からプロンプトに挿入する値を作成"""
+        data = current_report.get('data', {})
+        # 個別に埋め込む項目を除いた残りだけを追加情報として渡す
+        extra = {k: v for k, v in data.items() if k not in PROMPT_EXTRACTED_FIELDS}
+        return {
+            'current_date': data.get('submissionDate', ''),
+            'name': data.get('name', ''),
+            'good_things': data.get('goodThings', ''),
+            'reflections': data.get('reflections', ''),
+            'additional_info': json_dumps(extra),
+        }
+    
+    def create_ai_prompt(self, prompt_fields: Dict[str, str], previous_report: Optional[Dict[str, Any]]) -> str:
         """AIプロンプトを作成"""
-        template = self.config['prompts']['user_template']
-        
         # 前回レポートセクション
         previous_section = ""
         if previous_report:
@@ -106,110 +588,155 @@ class DailyReportProcessor:
             """
         
         # テンプレートに値を挿入
-        data = current_report.get('data', {})
-        prompt = template.format(
-            current_date=data.get('submissionDate', ''),
-            name=data.get('name', ''),
-            good_things=data.get('goodThings', ''),
-            reflections=data.get('reflections', ''),
-            additional_info=json.dumps(data, ensure_ascii=False, indent=2),
+        prompt = self._render_prompt(
+            **prompt_fields,
             previous_report_section=previous_section
         )
         
         return prompt
     
-    def call_github_copilot_api(self, prompt: str) -> Dict[str, Any]:
-        """GitHub Copilot APIを呼び出し"""
+    async def call_github_copilot_api(self, prompt: str) -> Tuple[Dict[str, Any], bool]:
+        """GitHub Copilot APIを呼び出し、フィードバックと取得に成功したかどうかを返す"""
         try:
-            headers = {
-                'Authorization': f'Bearer {self.github_token}',
-                'Content-Type': 'application/json'
-            }
+            payload = dict(self._payload_base)
+            payload['messages'] = [
+                self._system_message,
+                {
+                    'role': 'user',
+                    'content': prompt
+                }
+            ]
             
-            payload = {
-                'model': self.config['github_copilot']['model'],
-                'messages': [
-                    {
-                        'role': 'system',
-                        'content': self.config['prompts']['feedback_system']
-                    },
-                    {
-                        'role': 'user',
-                        'content': prompt
-                    }
-                ],
-                'max_tokens': self.config['github_copilot']['max_tokens'],
-                'temperature': self.config['github_copilot']['temperature']
-            }
+            # 同一プロンプトのフィードバックがキャッシュにあれば再利用
+            # diskcacheはSQLiteへの同期I/Oのため、イベントループを止めないよう別スレッドで実行する
+            cache_config, cache_key = None, ''
+            try:
+                cache_config, cache_key = self._response_cache_for(payload)
+                if cache_config is not None:
+                    cached = await asyncio.to_thread(
+                        read_cached_feedback, cache_config.get('directory'), cache_key
+                    )
+                    if cached is not None:
+                        return cached, True
+            except Exception as e:
+                logger.warning("フィードバックキャッシュ読み込みエラー (無視して続行): %s", e)
+                cache_config = None
             
-            response = requests.post(
-                self.config['github_copilot']['api_url'],
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
+            # 再試行・ヘッジを含めた全体の待ち時間をCOPILOT_TOTAL_TIMEOUTで打ち切る
+            deadline = asyncio.get_running_loop().time() + COPILOT_TOTAL_TIMEOUT
+            try:
+                status, body = await asyncio.wait_for(
+                    post_with_hedging(
+                        self.config['github_copilot']['api_url'],
+                        self._headers,
+                        payload,
+                        hedge_delay=self.config['github_copilot'].get('hedge_ms', 15000) / 1000,
+                        max_hedges=self.config['github_copilot'].get('max_concurrent_hedges', 10),
+                        deadline=deadline
+                    ),
+                    COPILOT_TOTAL_TIMEOUT
+                )
+            except asyncio.TimeoutError as e:
+                raise CopilotUnavailableError(f"{COPILOT_TOTAL_TIMEOUT}秒以内に応答がありません") from e
             
-            if response.status_code == 200:
-                result = response.json()
+            if status == 200:
+                result = json_loads(body)
                 content = result['choices'][0]['message']['content']
                 
                 # JSONレスポンスのパース
                 try:
-                    feedback = json.loads(content)
-                    return feedback
+                    feedback = json_loads(content)
                 except json.JSONDecodeError:
-                    # JSONパースに失敗した場合は文字列として返す
-                    return {"feedback_text": content}
+                    feedback = None
+                # JSONオブジェクト以外（パース失敗・数値・文字列・配列など）は文字列として返す
+                if not isinstance(feedback, dict):
+                    feedback = {"feedback_text": content}
+                
+                if cache_config is not None:
+                    try:
+                        await asyncio.to_thread(
+                            write_cached_feedback, cache_config.get('directory'), cache_key,
+                            feedback, cache_config.get('ttl_seconds', 86400)
+                        )
+                    except Exception as e:
+                        logger.warning("フィードバックキャッシュ書き込みエラー (無視して続行): %s", e)
+                
+                return feedback, True
             else:
-                logging.error(f"GitHub Copilot API エラー: {response.status_code} - {response.text}")
-                return {"error": f"API呼び出しエラー: {response.status_code}"}
+                logger.error("GitHub Copilot API エラー: %s - %s", status, body)
+                return {"error": f"API呼び出しエラー: {status}"}, False
                 
+        except CopilotUnavailableError as e:
+            # フィードバックなしでも日報は保存できるよう、エラー内容を構造化して返す
+            logger.error("GitHub Copilot API 利用不可: %s", e)
+            return {"error": "copilot_unavailable"}, False
         except Exception as e:
-            logging.error(f"GitHub Copilot API 呼び出しエラー: {e}")
-            return {"error": str(e)}
+            logger.error("GitHub Copilot API 呼び出しエラー: %s", e)
+            return {"error": str(e)}, False
     
-    def save_to_cosmosdb(self, report_data: Dict[str, Any], feedback: Dict[str, Any]) -> str:
-        """CosmosDBにデータを保存"""
+    def save_to_cosmosdb(self, report_data: Dict[str, Any], feedback: Dict[str, Any],
+                         feedback_ok: bool = True) -> str:
+        """CosmosDBへの保存を開始し、完了を待たずにドキュメントIDを返す"""
         try:
-            # 一意のIDを生成
-            report_id = f"report_{report_data.get('metadata', {}).get('submitterEmail', 'unknown')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            # 送信者と日付から決定的なIDを生成し、同じ日報の再送信は上書きする
+            report_id = make_report_id(
+                report_data.get('metadata', {}).get('submitterEmail', 'unknown'),
+                report_data.get('data', {}).get('submissionDate', '')
+            )
             
             # CosmosDB用のドキュメント作成
+            # metadata.submitterEmailはパーティションキーおよび前回日報の検索に使用する
             document = {
                 "id": report_id,
                 "type": "daily_report_with_feedback",
-                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "timestamp": current_timestamp(),
+                "metadata": report_data.get('metadata', {}),
+                "data": report_data.get('data', {}),
                 "ai_feedback": feedback,
             }
             
-            # CosmosDBに保存
-            container.create_item(body=document)
-            logging.info(f"データ保存成功: {report_id}")
+            # CosmosDBへの書き込みはバックグラウンドで行い、結果はコールバックでログに出力
+            # フィードバック取得に失敗した場合は、同じ日の保存済みフィードバックを上書きしない
+            container = get_container()
+            if container is None:
+                raise RuntimeError("CosmosDBに接続されていません")
+            task = asyncio.create_task(_write_report(container, document, overwrite=feedback_ok))
+            _pending_writes.add(task)
+            task.add_done_callback(functools.partial(_log_write_result, report_id))
             
             return report_id
             
         except Exception as e:
-            logging.error(f"CosmosDB保存エラー: {e}")
+            logger.error("CosmosDB保存エラー: %s", e)
             raise
 
+# 日報処理器はワーカーごとに一度だけ初期化して使い回す
+processor: Optional[DailyReportProcessor] = None
+processor_init_error = ""
+try:
+    processor = DailyReportProcessor(config)
+except ValueError as e:
+    logger.error("日報処理器の初期化エラー: %s", e)
+    processor_init_error = str(e)
+
 @app.route(route="daily_report_feedback")
-def daily_report_feedback(req: func.HttpRequest) -> func.HttpResponse:
+async def daily_report_feedback(req: func.HttpRequest) -> func.HttpResponse:
     """日報フィードバック生成のメイン関数"""
-    logging.info('日報フィードバック処理開始')
+    logger.info('日報フィードバック処理開始')
     
     try:
         # リクエストボディからJSONデータを取得
         try:
-            req_body = req.get_json()
+            req_body = json_loads(req.get_body())
             if not req_body:
                 return func.HttpResponse(
-                    json.dumps({"error": "JSONデータが必要です"}, ensure_ascii=False),
+                    json_dumps({"error": "JSONデータが必要です"}),
                     status_code=400,
                     mimetype="application/json"
                 )
         except ValueError as e:
             return func.HttpResponse(
-                json.dumps({"error": f"無効なJSONデータ: {str(e)}"}, ensure_ascii=False),
+                json_dumps({"error": f"無効なJSONデータ: {str(e)}"}),
                 status_code=400,
                 mimetype="application/json"
             )
@@ -219,13 +746,18 @@ def daily_report_feedback(req: func.HttpRequest) -> func.HttpResponse:
         for field in required_fields:
             if field not in req_body:
                 return func.HttpResponse(
-                    json.dumps({"error": f"必須フィールドが不足: {field}"}, ensure_ascii=False),
+                    json_dumps({"error": f"必須フィールドが不足: {field}"}),
                     status_code=400,
                     mimetype="application/json"
                 )
         
-        # 日報処理器を初期化
-        processor = DailyReportProcessor(config)
+        # 日報処理器の初期化に失敗している場合（GITHUB_TOKEN未設定など）
+        if processor is None:
+            return func.HttpResponse(
+                json_dumps({"error": f"処理中にエラーが発生しました: {processor_init_error}"}),
+                status_code=500,
+                mimetype="application/json"
+            )
         
         # 送信者のメールアドレスと日付を取得
         submitter_email = req_body.get('metadata', {}).get('submitterEmail')
@@ -233,22 +765,27 @@ def daily_report_feedback(req: func.HttpRequest) -> func.HttpResponse:
         
         if not submitter_email or not submission_date:
             return func.HttpResponse(
-                json.dumps({"error": "送信者メールアドレスまたは送信日付が不足しています"}, ensure_ascii=False),
+                json_dumps({"error": "送信者メールアドレスまたは送信日付が不足しています"}),
                 status_code=400,
                 mimetype="application/json"
             )
         
-        # 前回の日報を取得
-        previous_report = processor.get_previous_report(submitter_email, submission_date)
+        # 前回の日報取得を開始し、待っている間に今回分のプロンプト素材を準備
+        previous_task = asyncio.create_task(
+            processor.get_previous_report(submitter_email, submission_date)
+        )
+        await asyncio.sleep(0)  # クエリを送信させてから準備処理に移る
+        prompt_fields = processor.prepare_prompt_fields(req_body)
+        previous_report = await previous_task
         
         # AIプロンプトを作成
-        prompt = processor.create_ai_prompt(req_body, previous_report)
+        prompt = processor.create_ai_prompt(prompt_fields, previous_report)
         
         # GitHub Copilot APIを呼び出し
-        feedback = processor.call_github_copilot_api(prompt)
+        feedback, feedback_ok = await processor.call_github_copilot_api(prompt)
         
         # CosmosDBに保存
-        document_id = processor.save_to_cosmosdb(req_body, feedback)
+        document_id = processor.save_to_cosmosdb(req_body, feedback, feedback_ok)
         
         # レスポンスの作成
         response_data = {
@@ -256,19 +793,19 @@ def daily_report_feedback(req: func.HttpRequest) -> func.HttpResponse:
             "document_id": document_id,
             "feedback": feedback,
             "has_previous_report": previous_report is not None,
-            "processed_at": datetime.now(timezone.utc).isoformat()
+            "processed_at": current_timestamp()
         }
         
         return func.HttpResponse(
-            json.dumps(response_data, ensure_ascii=False, indent=2),
+            json_dumps(response_data, indent=True),
             status_code=200,
             mimetype="application/json"
         )
         
     except Exception as e:
-        logging.error(f"日報フィードバック処理エラー: {str(e)}")
+        logger.error("日報フィードバック処理エラー: %s", e)
         return func.HttpResponse(
-            json.dumps({"error": f"処理中にエラーが発生しました: {str(e)}"}, ensure_ascii=False),
+            json_dumps({"error": f"処理中にエラーが発生しました: {str(e)}"}),
             status_code=500,
             mimetype="application/json"
         )
\ No newline at end of file